@@ -1,5 +1,9 @@
 # 📦 nse_fetcher.py
 import requests
+import os
+import queue
+import random
+import threading
 import time
 
 HEADERS = {
@@ -8,27 +12,216 @@ HEADERS = {
     "Referer": "https://www.nseindia.com"
 }
 
-def warmup_session():
-    session = requests.Session()
+# ⏱️ Fetch budget settings
+RUN_BUDGET = 45          # seconds for a whole fetch run, shared by all symbols
+CALL_BUDGET = 20         # used by a single call that is not given a deadline
+REQUEST_TIMEOUT = 10     # upper bound for a single request
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1
+BACKOFF_CAP = 8
+HEDGE_PERCENTILE = 0.9   # send a duplicate request once this latency is exceeded
+HEDGE_DEFAULT_DELAY = 3  # used until enough latencies have been recorded
+HEDGE_MIN_DELAY = 1      # never hedge sooner than this, whatever the history says
+HEDGE_MIN_SAMPLES = 5
+LATENCY_HISTORY = 200    # most recent latencies kept across runs
+LATENCY_LOG = "performance/fetch_latency.csv"
+
+_latencies = None
+
+class NSEHTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+# 🕒 Deadline for a run whose budget is split across several fetches
+def start_run(budget=RUN_BUDGET):
+    return time.monotonic() + budget
+
+# 📈 Request latencies, persisted so the hedge percentile has history to work with
+def _load_latencies():
+    global _latencies
+    if _latencies is None:
+        _latencies = []
+        try:
+            with open(LATENCY_LOG) as f:
+                next(f, None)
+                _latencies = [float(line) for line in f if line.strip()][-LATENCY_HISTORY:]
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"⚠️ Could not read latency log: {e}")
+    return _latencies
+
+def record_latency(seconds):
+    latencies = _load_latencies()
+    latencies.append(round(seconds, 3))
+    del latencies[:-LATENCY_HISTORY]
+
+def save_latencies():
+    # Written from the main thread via a temp file so an interrupted write never truncates the log
+    if not _latencies:
+        return
+    tmp_path = LATENCY_LOG + ".tmp"
     try:
-        session.get("https://www.nseindia.com", headers=HEADERS, timeout=10)
-        time.sleep(1)
-    except Exception as e:
-        print(f"⚠️ NSE warm-up failed: {e}")
+        os.makedirs(os.path.dirname(LATENCY_LOG), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            f.write("latency\n" + "".join(f"{x}\n" for x in _latencies))
+        os.replace(tmp_path, LATENCY_LOG)
+    except OSError as e:
+        print(f"⚠️ Could not write latency log: {e}")
+
+def hedge_delay():
+    ordered = sorted(_load_latencies())
+    if len(ordered) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, ordered[min(int(len(ordered) * HEDGE_PERCENTILE), len(ordered) - 1)])
+
+def backoff_delay(attempt):
+    # Full jitter: uniform over [0, capped exponential]
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+# 🧵 Requests run on daemon threads so an abandoned one never holds up process exit
+def _in_background(target, *args):
+    threading.Thread(target=target, args=args, daemon=True).start()
+
+def _new_session(cookies=None):
+    session = requests.Session()
+    if cookies:
+        session.cookies.update(cookies)
     return session
 
-def fetch_option_chain(symbol):
-    url = f"https://www.nseindia.com/api/option-chain-indices?symbol={symbol}"
-    session = warmup_session()
+def warmup_cookies(timeout=REQUEST_TIMEOUT):
+    end = time.monotonic() + timeout
+    session = _new_session()
+    done = threading.Event()
+
+    def warm():
+        try:
+            session.get("https://www.nseindia.com", headers=HEADERS, timeout=timeout)
+        except Exception as e:
+            print(f"⚠️ NSE warm-up failed: {e}")
+        finally:
+            done.set()
+
+    _in_background(warm)
+    if not done.wait(timeout):
+        print("⚠️ NSE warm-up timed out")
+        return {}
+    cookies = session.cookies.get_dict()
+    session.close()
+    time.sleep(max(0, min(1, end - time.monotonic())))
+    return cookies
+
+def _get_json(session, url, timeout, parse, results, request_id):
     try:
-        response = session.get(url, headers=HEADERS, timeout=10)
+        response = session.get(url, headers=HEADERS, timeout=timeout)
         if response.status_code != 200:
-            raise Exception(f"HTTP {response.status_code}")
-        data = response.json()
-        return data.get("records", {})
+            raise NSEHTTPError(response.status_code)
+        results.put((request_id, parse(response.json()), None))
     except Exception as e:
-        print(f"⚠️ Option chain fetch failed for {symbol}: {e}")
+        results.put((request_id, None, e))
+
+def hedged_get(url, timeout, cookies, parse):
+    end = time.monotonic() + timeout
+    hedge_at = time.monotonic() + hedge_delay()
+    results = queue.Queue()
+    sessions, started = [], {}
+
+    def launch(budget):
+        # Each request gets its own session; none is shared with an unfinished one
+        session = _new_session(cookies)
+        sessions.append(session)
+        request_id = len(started)
+        started[request_id] = time.monotonic()
+        _in_background(_get_json, session, url, budget, parse, results, request_id)
+
+    launch(timeout)
+    hedged = False
+    error = TimeoutError(f"No response within {timeout:.1f}s")
+    try:
+        while started:
+            now = time.monotonic()
+            wake = end if hedged else min(hedge_at, end)
+            try:
+                request_id, payload, exc = results.get(timeout=max(wake - now, 0))
+                record_latency(time.monotonic() - started.pop(request_id))
+                if exc is None:
+                    return payload
+                error = exc
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if now >= end:
+                break
+            if started and not hedged and now >= hedge_at:
+                hedged = True
+                launch(end - now)
+        raise error
+    finally:
+        # Requests still in flight were abandoned; their elapsed time is a lower bound on latency
+        for start in started.values():
+            record_latency(time.monotonic() - start)
+        # This only frees idle pooled connections. An in-flight request keeps its socket until
+        # its own timeout; it is the daemon threads that keep it from blocking process exit.
+        for session in sessions:
+            session.close()
+
+def fetch_with_budget(name, url, parse, deadline=None, symbols_left=1):
+    if deadline is None:
+        deadline = time.monotonic() + CALL_BUDGET
+    # Each fetch gets an equal share of what is left; unused time rolls over
+    slice_end = time.monotonic() + max(deadline - time.monotonic(), 0) / max(symbols_left, 1)
+    if slice_end - time.monotonic() <= 0:
+        print(f"⚠️ {name} fetch skipped: run budget exhausted")
         return {}
 
-def fetch_vix():
-    return fetch_option_chain("INDIA VIX")
+    cookies = None
+    try:
+        for attempt in range(MAX_ATTEMPTS):
+            if cookies is None:
+                remaining = slice_end - time.monotonic()
+                if remaining <= 0:
+                    break
+                cookies = warmup_cookies(timeout=min(REQUEST_TIMEOUT, remaining))
+            remaining = slice_end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return hedged_get(url, min(REQUEST_TIMEOUT, remaining), cookies, parse)
+            except NSEHTTPError as e:
+                # Usually expired or missing cookies; warm up again before retrying
+                print(f"⚠️ {name} attempt {attempt + 1} failed: {e}")
+                cookies = None
+            except Exception as e:
+                print(f"⚠️ {name} attempt {attempt + 1} failed: {e}")
+            if attempt == MAX_ATTEMPTS - 1:
+                print(f"⚠️ {name} fetch failed: all {MAX_ATTEMPTS} attempts used")
+                return {}
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= slice_end:
+                break
+            time.sleep(delay)
+
+        print(f"⚠️ {name} fetch failed: time budget exhausted")
+        return {}
+    finally:
+        save_latencies()
+
+def _option_chain_records(data):
+    records = data.get("records", {})
+    if not records:
+        raise Exception("Empty option chain response")
+    return records
+
+def _vix_quote(data):
+    for row in data.get("data", []):
+        if row.get("index") == "INDIA VIX":
+            return row
+    raise Exception("INDIA VIX missing from index list")
+
+def fetch_option_chain(symbol, deadline=None, symbols_left=1):
+    url = f"https://www.nseindia.com/api/option-chain-indices?symbol={symbol}"
+    return fetch_with_budget(f"Option chain for {symbol}", url, _option_chain_records, deadline, symbols_left)
+
+def fetch_vix(deadline=None, symbols_left=1):
+    url = "https://www.nseindia.com/api/allIndices"
+    return fetch_with_budget("India VIX", url, _vix_quote, deadline, symbols_left)
@@ -1,11 +1,12 @@
 import pandas as pd
 import os
+import glob
 import requests
 import datetime
 import time
 import argparse
 import yfinance as yf
-from nse_fetcher import fetch_option_chain, fetch_vix
+from nse_fetcher import fetch_option_chain, fetch_vix as fetch_vix_records, start_run
 
 # 🔧 Add this helper function below the imports
 def fetch_nse_json(url):
@@ -47,6 +48,10 @@ parser.add_argument("--mode", choices=["evening", "morning"], default="evening")
 args = parser.parse_args()
 MODE = args.mode
 
+# 🕰️ Symbols whose live fetch failed, mapped to the fallback snapshot path
+STALE_SNAPSHOTS = {}
+MAX_SNAPSHOT_AGE_DAYS = 5
+
 # 🌐 Global indices
 def fetch_global_indices():
     indices = {
@@ -68,14 +73,14 @@ def fetch_global_indices():
         except Exception as e:
             summary[name] = {"error": str(e)}
     return summary
-
+# 🌪️ India VIX from the NSE index list, within the run deadline
 # 🌪️ India VIX fetch using nse_index_quote (reliable method)
 from nsepython import nsefetch
 
-def fetch_vix():
+def fetch_vix(deadline=None):
     try:
-        vix_data = fetch_vix()
-        vix_value = float(vix_data.get("underlyingValue", 0))
+        vix_data = fetch_vix_records(deadline)
+        vix_value = float(vix_data.get("last", 0))
         print(f"🌪️ India VIX fetched: {vix_value}")
         return vix_value
     except Exception as e:
@@ -115,10 +120,28 @@ def extract_flattened_rows(option_data, spot):
         "PE_LTP": pe.get("lastPrice", 0)
     }
 
+# 🕰️ Most recent stored snapshot for a symbol, if it is recent enough
+def latest_snapshot(symbol):
+    paths = sorted(glob.glob(f"data/{symbol}_????-??-??.csv"))
+    if not paths:
+        return None
+    snap_date = datetime.datetime.strptime(paths[-1][-14:-4], "%Y-%m-%d").date()
+    if (today - snap_date).days > MAX_SNAPSHOT_AGE_DAYS:
+        print(f"⚠️ Latest {symbol} snapshot {paths[-1]} is older than {MAX_SNAPSHOT_AGE_DAYS} days")
+        return None
+    return paths[-1]
+
+# 🧹 Drop snapshots too old to ever be used as a fallback
+def prune_snapshots():
+    for path in glob.glob("data/*_????-??-??.csv"):
+        snap_date = datetime.datetime.strptime(path[-14:-4], "%Y-%m-%d").date()
+        if (today - snap_date).days > MAX_SNAPSHOT_AGE_DAYS:
+            os.remove(path)
+
 # 📦 Fetch and save FnO data
-def fetch_and_save(symbol):
+def fetch_and_save(symbol, deadline=None, symbols_left=1):
     try:
-        records = fetch_option_chain(symbol)
+        records = fetch_option_chain(symbol, deadline, symbols_left)
         spot = float(records.get("underlyingValue", 0))
         raw = records.get("data", [])
 
@@ -127,13 +150,17 @@ def fetch_and_save(symbol):
 
         rows = [extract_flattened_rows(row, spot) for row in raw]
         clean_rows = [r for r in rows if r]
-        date_save = date_str
+        date_save = tomorrow_str if MODE == "evening" else today_str
         pd.DataFrame(clean_rows).to_csv(f"data/{symbol}_{date_save}.csv", index=False)
 
         print(f"✅ Saved {len(clean_rows)} rows for {symbol} ({MODE})")
         print(f"📁 Saved to: data/{symbol}_{date_save}.csv")
     except Exception as e:
         print(f"⚠️ Error fetching {symbol}: {e}")
+        snapshot = latest_snapshot(symbol)
+        if snapshot:
+            STALE_SNAPSHOTS[symbol] = snapshot
+            print(f"🕰️ Using stale snapshot for {symbol}: {snapshot}")
 
 # 🧠 Trade scoring
 def interpret_pcr(pcr):
@@ -159,11 +186,18 @@ def score_trade(pcr_sentiment, vol_surge, oi_trend, vix_level, global_score):
 # 🔍 Analyze and suggest trades
 def analyze(symbol, global_data, vix_level):
     date_to_use = tomorrow_str if MODE == "evening" else today_str
-    filename = f"data/{symbol}_{date_to_use}.csv"
+    filename = STALE_SNAPSHOTS.get(symbol, f"data/{symbol}_{date_to_use}.csv")
     if not os.path.exists(filename):
         return [f"⚠️ {symbol} data not available. Skipping..."]
 
     df = pd.read_csv(filename)
+    stale = symbol in STALE_SNAPSHOTS
+    if stale:
+        # Contracts may have expired since the snapshot was taken
+        expiries = pd.to_datetime(df["expiryDate"], format="%d-%b-%Y", errors="coerce").dt.date
+        df = df[expiries >= today]
+        if df.empty:
+            return [f"⚠️ {symbol} stale snapshot has no unexpired contracts. Skipping..."]
     ce_oi, pe_oi = df["CE_OI"].sum(), df["PE_OI"].sum()
     pcr = round(pe_oi / ce_oi, 2) if ce_oi else "N/A"
     pcr_sentiment = interpret_pcr(pcr)
@@ -216,15 +250,19 @@ def analyze(symbol, global_data, vix_level):
         "score": score,
         "outcome": "Pending"
     }
-    log_df = pd.DataFrame([log_row])
-    log_path = "performance/performance_log.csv"
-    if os.path.exists(log_path):
-        log_df.to_csv(log_path, mode="a", header=False, index=False)
-    else:
-        log_df.to_csv(log_path, index=False)
-
-    return [
-        f"## 📘 {symbol} ({MODE.capitalize()} Mode)",
+    # Stale signals are reported but not tracked as trades
+    if not stale:
+        log_df = pd.DataFrame([log_row])
+        log_path = "performance/performance_log.csv"
+        if os.path.exists(log_path):
+            log_df.to_csv(log_path, mode="a", header=False, index=False)
+        else:
+            log_df.to_csv(log_path, index=False)
+
+    lines = [f"## 📘 {symbol} ({MODE.capitalize()} Mode)"]
+    if stale:
+        lines.append(f"- 🕰️ Stale data: live fetch failed, using snapshot `{filename}` (not logged)")
+    return lines + [
         f"- 🔄 PCR: `{pcr}` → `{pcr_sentiment}`",
         f"- 🔢 Top Strike: `{top_strike}`",
         f"- 📆 Expiry: `{expiry}`",
@@ -238,9 +276,9 @@ def analyze(symbol, global_data, vix_level):
     ]
 
 # 📑 Generate markdown report
-def generate_report():
+def generate_report(deadline=None):
     global_data = fetch_global_indices()
-    vix_level = fetch_vix()
+    vix_level = fetch_vix(deadline)
     date_to_use = tomorrow_str if MODE == "evening" else today_str
     summary_lines = [f"# 📊 FnO Tracker Report – {date_to_use}"]
     summary_lines.append(f"- 🌪️ India VIX: `{vix_level}`")
@@ -271,9 +309,13 @@ def generate_performance_summary():
 if __name__ == "__main__":
     import traceback
     try:
-        fetch_and_save("BANKNIFTY")
-        fetch_and_save("NIFTY")
-        generate_report()
+        symbols = ["BANKNIFTY", "NIFTY"]
+        deadline = start_run()
+        # Leave one share of the budget for the VIX fetch in generate_report()
+        for i, symbol in enumerate(symbols):
+            fetch_and_save(symbol, deadline, len(symbols) - i + 1)
+        prune_snapshots()
+        generate_report(deadline)
         generate_performance_summary()
     except Exception:
         traceback.print_exc()